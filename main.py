@@ -1,14 +1,96 @@
-import os
+import time
 import asyncio
-from typing import Any, Dict, Optional, List
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional, List, Tuple
 
 import httpx
-from dotenv import load_dotenv
+import orjson
 from fastapi import FastAPI, HTTPException, Query
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
-load_dotenv()
 
-app = FastAPI(title="KVK Company Lookup API", version="1.0.2")
+class Settings(BaseSettings):
+    """Process-wide configuration, read once from the environment / .env."""
+
+    # .env next to this file, not in the CWD, so it's found wherever uvicorn is started from
+    model_config = SettingsConfigDict(
+        env_file=Path(__file__).with_name(".env"),
+        extra="ignore",
+        str_strip_whitespace=True,
+    )
+
+    kvk_env: str = "prod"
+    kvk_api_key: str = ""
+    kvk_vestiging_concurrency: int = 10
+    kvk_cache_ttl: float = 600
+    kvk_cache_ttl_not_found: float = 60
+
+
+settings = Settings()
+
+API_KEY = settings.kvk_api_key
+HEADERS = {"apikey": API_KEY}
+
+# KVK expects lowercase "true"/"false" query values.
+_BOOL_STR = {True: "true", False: "false"}
+
+# In-process TTL cache for upstream GETs. KVK data changes slowly; 404s get a
+# shorter TTL so newly registered records show up soon. Expired entries are
+# kept (until evicted) so their ETag can turn the next fetch into a 304.
+CACHE_TTL = settings.kvk_cache_ttl
+CACHE_TTL_NOT_FOUND = settings.kvk_cache_ttl_not_found
+CACHE_MAXSIZE = 4096
+
+CacheKey = Tuple[str, Tuple[Tuple[str, Any], ...]]
+
+# (expires_at, status_code, body-or-404-detail, etag, vestigingsnummers). The last
+# slot is only used on /vestigingen entries, filled on first extraction.
+CacheEntry = Tuple[float, int, Any, Optional[str], Optional[List[str]]]
+
+_cache: Dict[CacheKey, CacheEntry] = {}
+_cache_stats = {"hits": 0, "misses": 0, "coalesced": 0, "revalidated": 0}
+
+# key -> task running the upstream fetch for it, so concurrent identical
+# requests share one upstream call.
+_inflight: Dict[CacheKey, "asyncio.Task[Dict[str, Any]]"] = {}
+
+# upstream responses per negotiated protocol, e.g. {"HTTP/2": 120}; the pool
+# sizing assumes KVK actually speaks HTTP/2
+_http_versions: Dict[str, int] = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    One shared AsyncClient for the whole process, so keep-alive connections
+    to api.kvk.nl are reused instead of doing a TLS handshake per upstream call.
+
+    HTTP/2 lets the parallel subresource / vestigingsprofiel fetches multiplex
+    on a single connection, so the pool can stay small.
+    """
+    if not API_KEY:
+        raise RuntimeError("Missing KVK_API_KEY in environment/.env")
+
+    # Caps the vestigingsprofielen fan-out in /company/full; keep it below the
+    # client's max_connections so one large company can't exhaust the pool.
+    # Created here so it belongs to the loop that serves the app.
+    app.state.vest_sem = asyncio.Semaphore(settings.kvk_vestiging_concurrency)
+    app.state.client = httpx.AsyncClient(
+        http2=True,
+        headers=HEADERS,
+        timeout=httpx.Timeout(connect=3.0, read=10.0, write=5.0, pool=5.0),
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30),
+    )
+    try:
+        yield
+    finally:
+        await app.state.client.aclose()
+
+
+# Large endpoint payloads are encoded by Pydantic straight to JSON bytes, which
+# FastAPI does when the route has a return type; hence the -> Dict[str, Any].
+app = FastAPI(title="KVK Company Lookup API", version="1.0.2", lifespan=lifespan)
 
 
 def kvk_base_urls(env: str) -> Dict[str, str]:
@@ -36,43 +118,149 @@ def kvk_base_urls(env: str) -> Dict[str, str]:
     }
 
 
-def get_headers() -> Dict[str, str]:
-    api_key = (os.getenv("KVK_API_KEY") or "").strip()
-    if not api_key:
-        raise HTTPException(status_code=500, detail="Missing KVK_API_KEY in environment/.env")
-    return {"apikey": api_key}
+# The environment doesn't change while the process runs; resolve the URLs once.
+KVK_ENV = settings.kvk_env
+URLS = kvk_base_urls(KVK_ENV)
 
 
-async def kvk_get(url: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+def _build_http_error(r: httpx.Response) -> HTTPException:
+    """Turns a non-2xx KVK response into an HTTPException carrying KVK's error body."""
+    try:
+        body = orjson.loads(r.content)
+    except Exception:
+        body = {"raw": r.text}
+
+    return HTTPException(
+        status_code=r.status_code,
+        detail={
+            "kvk_status": r.status_code,
+            "kvk_url": str(r.request.url),
+            "kvk_error": body,
+        },
+    )
+
+
+async def _kvk_fetch(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    etag: Optional[str] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
     """
-    Generic GET wrapper that forwards KVK error details.
+    Uncached GET against KVK that forwards KVK error details.
+    Returns (body, etag); body is None when KVK answers 304 to our If-None-Match.
     """
+    client: httpx.AsyncClient = app.state.client
+    headers = {"If-None-Match": etag} if etag else None
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            r = await client.get(url, headers=get_headers(), params=params or {})
-
-        if r.status_code >= 400:
-            try:
-                body = r.json()
-            except Exception:
-                body = {"raw": r.text}
-
-            raise HTTPException(
-                status_code=r.status_code,
-                detail={
-                    "kvk_status": r.status_code,
-                    "kvk_url": str(r.request.url),
-                    "kvk_error": body,
-                },
-            )
-
-        return r.json()
-
+        r = await client.get(url, params=params or {}, headers=headers)
+    except httpx.PoolTimeout:
+        raise HTTPException(status_code=503, detail="KVK connection pool exhausted, try again")
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="KVK upstream timeout")
     except httpx.RequestError as e:
         raise HTTPException(status_code=502, detail=f"KVK upstream error: {str(e)}")
 
+    _http_versions[r.http_version] = _http_versions.get(r.http_version, 0) + 1
+    if r.is_success:
+        return orjson.loads(r.content), r.headers.get("etag")
+    if r.status_code == 304 and etag:
+        return None, etag
+    raise _build_http_error(r)
+
+
+def _cache_key(url: str, params: Optional[Dict[str, Any]] = None) -> CacheKey:
+    return (url, tuple(sorted((params or {}).items())))
+
+
+def _cache_put(
+    key: CacheKey,
+    ttl: float,
+    status_code: int,
+    value: Any,
+    etag: Optional[str] = None,
+    vestigingsnummers: Optional[List[str]] = None,
+) -> None:
+    _cache.pop(key, None)
+    if len(_cache) >= CACHE_MAXSIZE:
+        # dicts keep insertion order, so the first key is the oldest entry
+        _cache.pop(next(iter(_cache)))
+    _cache[key] = (time.monotonic() + ttl, status_code, value, etag, vestigingsnummers)
+
+
+async def kvk_get(url: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Generic GET wrapper that forwards KVK error details.
+    Successful responses are cached for CACHE_TTL, 404s for CACHE_TTL_NOT_FOUND;
+    other errors are never cached. Concurrent misses for the same key share one
+    upstream fetch instead of going upstream again. An expired entry
+    with an ETag is revalidated with If-None-Match and reused on 304.
+    """
+    key = _cache_key(url, params)
+    entry = _cache.get(key)
+    if entry is not None and entry[0] > time.monotonic():
+        _cache_stats["hits"] += 1
+        status_code, value = entry[1], entry[2]
+        if status_code == 404:
+            raise HTTPException(status_code=404, detail=value)
+        return value
+
+    task = _inflight.get(key)
+    if task is not None:
+        _cache_stats["coalesced"] += 1
+    else:
+        _cache_stats["misses"] += 1
+        stale = entry if entry is not None and entry[1] == 200 and entry[3] else None
+        task = asyncio.ensure_future(_kvk_fetch_and_store(key, url, params, stale))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _inflight_done(key, t))
+
+    # The fetch runs as its own task and every caller (the first one included)
+    # awaits it through shield, so no caller's cancellation can abort it.
+    return await asyncio.shield(task)
+
+
+async def _kvk_fetch_and_store(
+    key: CacheKey,
+    url: str,
+    params: Optional[Dict[str, Any]],
+    stale: Optional[CacheEntry],
+) -> Dict[str, Any]:
+    try:
+        body, etag = await _kvk_fetch(url, params=params, etag=stale[3] if stale else None)
+    except HTTPException as e:
+        if e.status_code == 404:
+            _cache_put(key, CACHE_TTL_NOT_FOUND, 404, e.detail)
+        raise
+
+    if body is None:
+        # 304: same body, so anything extracted from it still holds
+        _cache_stats["revalidated"] += 1
+        _cache_put(key, CACHE_TTL, 200, stale[2], etag, stale[4])
+        return stale[2]
+
+    _cache_put(key, CACHE_TTL, 200, body, etag)
+    return body
+
+
+def _inflight_done(key: CacheKey, task: "asyncio.Task[Dict[str, Any]]") -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    # mark the exception as retrieved even when every caller went away
+    if not task.cancelled():
+        task.exception()
+
+
+async def kvk_get_optional(url: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Like kvk_get, but returns None when KVK answers 404.
+    """
+    try:
+        return await kvk_get(url, params=params)
+    except HTTPException as e:
+        if e.status_code == 404:
+            return None
+        raise
+
 
 async def search_kvk_number_by_name(
     zoeken_url: str,
@@ -87,7 +275,7 @@ async def search_kvk_number_by_name(
         "naam": name,
         "pagina": page,
         "resultatenPerPagina": per_page,
-        "inclusiefInactieveRegistraties": str(include_inactive).lower(),
+        "inclusiefInactieveRegistraties": _BOOL_STR[include_inactive],
     }
 
     if place:
@@ -111,40 +299,31 @@ async def fetch_basisprofiel(
 
     Note: Some test records don't provide all subresources -> return None for 404.
     """
-    base_params = {"geoData": str(geo_data).lower()}
-    main_profile = await kvk_get(f"{basis_url}/{kvk_number}", params=base_params)
+    base_params = {"geoData": _BOOL_STR[geo_data]}
+    profile_url = f"{basis_url}/{kvk_number}"
 
     if not include_subresources:
-        return {"basisprofiel": main_profile}
-
-    async with httpx.AsyncClient(timeout=20) as client:
-        headers = get_headers()
-
-        async def get_json_optional(path: str) -> Optional[Dict[str, Any]]:
-            r = await client.get(path, headers=headers, params=base_params)
-
-         
-            if r.status_code == 404:
-                return None
-
-            if r.status_code >= 400:
-                try:
-                    return {"_error": r.json(), "_status": r.status_code, "_url": str(r.request.url)}
-                except Exception:
-                    return {"_error": r.text, "_status": r.status_code, "_url": str(r.request.url)}
-
-            return r.json()
-
-        eigenaar_url = f"{basis_url}/{kvk_number}/eigenaar"
-        hoofdvestiging_url = f"{basis_url}/{kvk_number}/hoofdvestiging"
-        vestigingen_url = f"{basis_url}/{kvk_number}/vestigingen"
-
-        eigenaar, hoofdvestiging, vestigingen = await asyncio.gather(
-            get_json_optional(eigenaar_url),
-            get_json_optional(hoofdvestiging_url),
-            get_json_optional(vestigingen_url),
-        )
-
+        return {"basisprofiel": await kvk_get(profile_url, params=base_params)}
+
+    async def get_json_optional(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await kvk_get_optional(path, params=base_params)
+        except HTTPException as e:
+            if not isinstance(e.detail, dict):
+                raise
+            error = e.detail["kvk_error"]
+            # _build_http_error wraps non-JSON bodies as {"raw": text}; subresources report the bare text
+            if isinstance(error, dict) and error.keys() == {"raw"}:
+                error = error["raw"]
+            return {"_error": error, "_status": e.status_code, "_url": e.detail["kvk_url"]}
+
+    # None of the subresources depend on the main profile body, so all four go out together.
+    main_profile, eigenaar, hoofdvestiging, vestigingen = await asyncio.gather(
+        kvk_get(profile_url, params=base_params),
+        get_json_optional(f"{profile_url}/eigenaar"),
+        get_json_optional(f"{profile_url}/hoofdvestiging"),
+        get_json_optional(f"{profile_url}/vestigingen"),
+    )
 
     return {
         "basisprofiel": main_profile,
@@ -158,12 +337,7 @@ async def fetch_naamgeving(naamgevingen_base_url: str, kvk_number: str) -> Optio
     Naamgeving API:
       GET {naamgevingen_base_url}/kvknummer/{kvk_number}
     """
-    try:
-        return await kvk_get(f"{naamgevingen_base_url}/kvknummer/{kvk_number}")
-    except HTTPException as e:
-        if e.status_code == 404:
-            return None
-        raise
+    return await kvk_get_optional(f"{naamgevingen_base_url}/kvknummer/{kvk_number}")
 
 
 async def fetch_vestigingsprofiel(vestigingsprofielen_url: str, vestigingsnummer: str) -> Optional[Dict[str, Any]]:
@@ -171,56 +345,106 @@ async def fetch_vestigingsprofiel(vestigingsprofielen_url: str, vestigingsnummer
     Vestigingsprofiel API:
       GET {vestigingsprofielen_url}/{vestigingsnummer}
     """
-    try:
-        return await kvk_get(f"{vestigingsprofielen_url}/{vestigingsnummer}")
-    except HTTPException as e:
-        if e.status_code == 404:
-            return None
-        raise
+    return await kvk_get_optional(f"{vestigingsprofielen_url}/{vestigingsnummer}")
 
 
 def extract_vestigingsnummers(vestigingen_payload: Dict[str, Any]) -> List[str]:
     """
     Attempts to extract vestigingsnummers from the 'vestigingen' payload.
     Different test/prod records may structure it differently.
-    Returns a de-duplicated list.
+    Returns a de-duplicated list in the order KVK lists them.
     """
-    found: List[str] = []
+    seen: Dict[str, None] = {}
 
-    items = vestigingen_payload.get("vestigingen")
-    if isinstance(items, list):
+    def push(items: Any) -> None:
+        if not isinstance(items, list):
+            return
         for it in items:
             if isinstance(it, dict):
                 vn = it.get("vestigingsnummer") or it.get("vestigingsNummer")
                 if vn:
-                    found.append(str(vn))
+                    seen.setdefault(str(vn), None)
 
+    push(vestigingen_payload.get("vestigingen"))
 
     embedded = vestigingen_payload.get("_embedded") or {}
     if isinstance(embedded, dict):
-        for _, val in embedded.items():
-            if isinstance(val, list):
-                for it in val:
-                    if isinstance(it, dict):
-                        vn = it.get("vestigingsnummer") or it.get("vestigingsNummer")
-                        if vn:
-                            found.append(str(vn))
+        for val in embedded.values():
+            push(val)
+
+    return list(seen)
+
+
+async def fetch_basisprofiel_with_vns(
+    basis_url: str,
+    kvk_number: str,
+    geo_data: bool = False,
+    include_subresources: bool = True,
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    fetch_basisprofiel plus the vestigingsnummers extracted from its vestigingen.
+    The extraction is stored in the /vestigingen cache entry itself, so it
+    expires and is evicted together with the body it came from.
+    """
+    details = await fetch_basisprofiel(
+        basis_url=basis_url,
+        kvk_number=kvk_number,
+        geo_data=geo_data,
+        include_subresources=include_subresources,
+    )
+    vestigingen = details.get("vestigingen")
+    if not vestigingen:
+        return details, []
 
+    # same key fetch_basisprofiel used for the vestigingen subresource
+    key = _cache_key(f"{basis_url}/{kvk_number}/vestigingen", {"geoData": _BOOL_STR[geo_data]})
+    entry = _cache.get(key)
+    if entry is None or entry[2] is not vestigingen:
+        # an _error dict, or the entry was evicted/replaced: nothing to store it with
+        return details, extract_vestigingsnummers(vestigingen)
 
-    return sorted(set(found))
+    if entry[4] is None:
+        # assigning to an existing key keeps its eviction order and expiry
+        entry = entry[:4] + (extract_vestigingsnummers(vestigingen),)
+        _cache[key] = entry
+    return details, entry[4]
 
 
 @app.get("/debug/kvk")
 def debug_kvk():
-    """Quick check to confirm env + URL base + key presence (does NOT reveal the key)."""
-    key = (os.getenv("KVK_API_KEY") or "").strip()
-    env = os.getenv("KVK_ENV", "prod")
-    urls = kvk_base_urls(env)
+    """
+    Quick check to confirm env + URL base + key length (does NOT reveal the key).
+    A missing key already stops startup, so there's no separate "present" flag.
+    """
+    return {
+        "KVK_ENV": KVK_ENV,
+        "KVK_API_KEY_len": len(API_KEY),
+        "urls": URLS,
+        "upstream_http_versions": _http_versions,
+    }
+
+
+@app.get("/debug/cache")
+def debug_cache():
+    """
+    Upstream response cache size and counters.
+      - hit_ratio: share of kvk_get calls answered from the cache alone
+      - avoided_ratio: share of kvk_get calls that didn't start an upstream
+        fetch, i.e. cache hits plus calls coalesced onto an in-flight fetch
+    """
+    hits, misses, coalesced = _cache_stats["hits"], _cache_stats["misses"], _cache_stats["coalesced"]
+    calls = hits + misses + coalesced
     return {
-        "KVK_ENV": env,
-        "KVK_API_KEY_present": bool(key),
-        "KVK_API_KEY_len": len(key),
-        "urls": urls,
+        "size": len(_cache),
+        "maxsize": CACHE_MAXSIZE,
+        "ttl": CACHE_TTL,
+        "ttl_not_found": CACHE_TTL_NOT_FOUND,
+        "hits": hits,
+        "misses": misses,
+        "coalesced": coalesced,
+        "revalidated": _cache_stats["revalidated"],
+        "hit_ratio": hits / calls if calls else 0.0,
+        "avoided_ratio": (hits + coalesced) / calls if calls else 0.0,
     }
 
 
@@ -233,7 +457,8 @@ async def get_company(
     include_inactive: bool = Query(default=False),
     geo_data: bool = Query(default=False),
     include_subresources: bool = Query(default=True),
-):
+    include_raw_search: bool = Query(default=False, description="Include the full zoeken response"),
+) -> Dict[str, Any]:
     """
     Usage:
       - /company?kvk_number=69599068
@@ -242,12 +467,10 @@ async def get_company(
     if not kvk_number and not name:
         raise HTTPException(status_code=400, detail="Provide either kvk_number or name")
 
-    urls = kvk_base_urls(os.getenv("KVK_ENV", "prod"))
-
 
     if kvk_number:
         details = await fetch_basisprofiel(
-            basis_url=urls["basisprofielen"],
+            basis_url=URLS["basisprofielen"],
             kvk_number=kvk_number,
             geo_data=geo_data,
             include_subresources=include_subresources,
@@ -256,7 +479,7 @@ async def get_company(
 
 
     zoek_res = await search_kvk_number_by_name(
-        zoeken_url=urls["zoeken"],
+        zoeken_url=URLS["zoeken"],
         name=name,
         place=place,
         street=street,
@@ -275,15 +498,19 @@ async def get_company(
         raise HTTPException(status_code=502, detail={"message": "Result missing kvkNummer", "best": best})
 
     details = await fetch_basisprofiel(
-        basis_url=urls["basisprofielen"],
+        basis_url=URLS["basisprofielen"],
         kvk_number=found_kvk,
         geo_data=geo_data,
         include_subresources=include_subresources,
     )
 
+    search: Dict[str, Any] = {"selected_result": best}
+    if include_raw_search:
+        search["raw"] = zoek_res
+
     return {
         "input": {"name": name, "place": place, "street": street},
-        "search": {"raw": zoek_res, "selected_result": best},
+        "search": search,
         "details": details,
     }
 
@@ -295,20 +522,25 @@ async def get_company_full(
     include_subresources: bool = Query(default=True),
     include_naamgeving: bool = Query(default=True),
     include_vestigingsprofielen: bool = Query(default=True),
-):
+) -> Dict[str, Any]:
     """
     Full pipeline:
       - basisprofiel (+ optional subresources)
       - naamgeving (optional)
       - vestigingsprofielen (optional, only if vestigingsnummers found)
     """
-    urls = kvk_base_urls(os.getenv("KVK_ENV", "prod"))
+    async def no_naamgeving() -> None:
+        return None
 
-    details = await fetch_basisprofiel(
-        basis_url=urls["basisprofielen"],
-        kvk_number=kvk_number,
-        geo_data=geo_data,
-        include_subresources=include_subresources,
+    # naamgeving doesn't depend on the basisprofiel, so fetch both at once.
+    (details, vestigingsnummers), naamgeving = await asyncio.gather(
+        fetch_basisprofiel_with_vns(
+            basis_url=URLS["basisprofielen"],
+            kvk_number=kvk_number,
+            geo_data=geo_data,
+            include_subresources=include_subresources,
+        ),
+        fetch_naamgeving(URLS["naamgevingen"], kvk_number) if include_naamgeving else no_naamgeving(),
     )
 
     response: Dict[str, Any] = {
@@ -317,18 +549,17 @@ async def get_company_full(
     }
 
     if include_naamgeving:
-        response["naamgeving"] = await fetch_naamgeving(urls["naamgevingen"], kvk_number)
+        response["naamgeving"] = naamgeving
 
     if include_vestigingsprofielen:
-        vestigingen_payload = details.get("vestigingen") or {}
-        vestigingsnummers = extract_vestigingsnummers(vestigingen_payload)
-
         response["vestigingsnummers"] = vestigingsnummers
 
         if vestigingsnummers:
-            profiles = await asyncio.gather(
-                *[fetch_vestigingsprofiel(urls["vestigingsprofielen"], vn) for vn in vestigingsnummers]
-            )
+            async def bounded(vn: str) -> Optional[Dict[str, Any]]:
+                async with app.state.vest_sem:
+                    return await fetch_vestigingsprofiel(URLS["vestigingsprofielen"], vn)
+
+            profiles = await asyncio.gather(*[bounded(vn) for vn in vestigingsnummers])
             response["vestigingsprofielen"] = profiles
         else:
             response["vestigingsprofielen"] = []
@@ -337,6 +568,5 @@ async def get_company_full(
 
 
 @app.get("/vestiging/{vestigingsnummer}")
-async def get_vestiging(vestigingsnummer: str):
-    urls = kvk_base_urls(os.getenv("KVK_ENV", "prod"))
-    return await fetch_vestigingsprofiel(urls["vestigingsprofielen"], vestigingsnummer)
+async def get_vestiging(vestigingsnummer: str) -> Optional[Dict[str, Any]]:
+    return await fetch_vestigingsprofiel(URLS["vestigingsprofielen"], vestigingsnummer)
@@ -0,0 +1,39 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    main._cache.clear()
+    main._inflight.clear()
+    main._http_versions.clear()
+    for k in main._cache_stats:
+        main._cache_stats[k] = 0
+    yield
+    main._cache.clear()
+    main._inflight.clear()
+
+
+@pytest.fixture
+def run_with_upstream():
+    """Runs coro_factory() with app.state.client backed by a MockTransport(handler)
+    and a fresh vestigingsprofielen semaphore, as lifespan would set them up."""
+
+    def run(handler, coro_factory):
+        async def runner():
+            previous = (getattr(main.app.state, "client", None), getattr(main.app.state, "vest_sem", None))
+            main.app.state.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            main.app.state.vest_sem = asyncio.Semaphore(main.settings.kvk_vestiging_concurrency)
+            try:
+                return await coro_factory()
+            finally:
+                await main.app.state.client.aclose()
+                main.app.state.client, main.app.state.vest_sem = previous
+
+        return asyncio.run(runner())
+
+    return run
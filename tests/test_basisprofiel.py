@@ -0,0 +1,29 @@
+import httpx
+
+import main
+
+KVK = "12345678"
+BASIS_URL = "https://api.kvk.nl/api/v1/basisprofielen"
+
+
+def test_subresource_errors_are_embedded(run_with_upstream):
+    def handler(request):
+        path = request.url.path
+        if path.endswith("/eigenaar"):
+            return httpx.Response(404, json={"fout": "not found"})
+        if path.endswith("/hoofdvestiging"):
+            return httpx.Response(500, text="upstream broke")
+        if path.endswith("/vestigingen"):
+            return httpx.Response(429, json={"fout": "rate limited"})
+        return httpx.Response(200, json={"kvkNummer": KVK})
+
+    details = run_with_upstream(handler, lambda: main.fetch_basisprofiel(BASIS_URL, KVK))
+
+    assert details["basisprofiel"] == {"kvkNummer": KVK}
+    assert details["hoofdvestiging"] == {
+        "_error": "upstream broke",
+        "_status": 500,
+        "_url": f"{BASIS_URL}/{KVK}/hoofdvestiging?geoData=false",
+    }
+    assert details["vestigingen"]["_error"] == {"fout": "rate limited"}
+    assert details["vestigingen"]["_status"] == 429
@@ -0,0 +1,41 @@
+import httpx
+
+import main
+
+KVK = "12345678"
+ZOEKEN = {"resultaten": [{"kvkNummer": KVK, "naam": "Test BV"}, {"kvkNummer": "87654321", "naam": "Other"}]}
+
+
+def handler(request):
+    if request.url.path.endswith("/zoeken"):
+        return httpx.Response(200, json=ZOEKEN)
+    if request.url.path.endswith(f"/basisprofielen/{KVK}"):
+        return httpx.Response(200, json={"kvkNummer": KVK})
+    return httpx.Response(404, json={"fout": "not found"})
+
+
+def company_by_name(include_raw_search):
+    return main.get_company(
+        kvk_number=None,
+        name="test",
+        place=None,
+        street=None,
+        include_inactive=False,
+        geo_data=False,
+        include_subresources=False,
+        include_raw_search=include_raw_search,
+    )
+
+
+def test_raw_search_is_omitted_by_default(run_with_upstream):
+    response = run_with_upstream(handler, lambda: company_by_name(False))
+
+    assert response["search"] == {"selected_result": ZOEKEN["resultaten"][0]}
+    assert response["details"] == {"basisprofiel": {"kvkNummer": KVK}}
+
+
+def test_raw_search_on_request(run_with_upstream):
+    response = run_with_upstream(handler, lambda: company_by_name(True))
+
+    assert response["search"]["raw"] == ZOEKEN
+    assert response["search"]["selected_result"] == ZOEKEN["resultaten"][0]
@@ -0,0 +1,70 @@
+import httpx
+
+import main
+
+KVK = "12345678"
+VESTIGINGSNUMMERS = [f"{n:012d}" for n in range(1, 26)]
+
+
+def kvk_handler(request):
+    path = request.url.path
+    if path.endswith("/vestigingen"):
+        return httpx.Response(200, json={"vestigingen": [{"vestigingsnummer": vn} for vn in VESTIGINGSNUMMERS]})
+    if "/vestigingsprofielen/" in path:
+        return httpx.Response(200, json={"vestigingsnummer": path.rsplit("/", 1)[-1]})
+    if path.endswith(f"/basisprofielen/{KVK}"):
+        return httpx.Response(200, json={"kvkNummer": KVK})
+    return httpx.Response(404, json={"fout": "not found"})
+
+
+async def company_full():
+    return await main.get_company_full(
+        kvk_number=KVK,
+        geo_data=False,
+        include_subresources=True,
+        include_naamgeving=True,
+        include_vestigingsprofielen=True,
+    )
+
+
+def test_fan_out_works_across_event_loops(run_with_upstream):
+    for _ in range(2):
+        main._cache.clear()
+        response = run_with_upstream(kvk_handler, company_full)
+        assert response["vestigingsnummers"] == VESTIGINGSNUMMERS
+        assert [p["vestigingsnummer"] for p in response["vestigingsprofielen"]] == VESTIGINGSNUMMERS
+        assert response["naamgeving"] is None
+
+
+def test_vestigingsnummers_are_stored_with_the_vestigingen_entry(run_with_upstream, monkeypatch):
+    extractions = []
+    extract = main.extract_vestigingsnummers
+
+    def counting_extract(payload):
+        extractions.append(payload)
+        return extract(payload)
+
+    monkeypatch.setattr(main, "extract_vestigingsnummers", counting_extract)
+
+    async def twice():
+        return await company_full(), await company_full()
+
+    first, second = run_with_upstream(kvk_handler, twice)
+
+    assert first["vestigingsnummers"] == second["vestigingsnummers"] == VESTIGINGSNUMMERS
+    assert len(extractions) == 1
+    entry = main._cache[main._cache_key(f"{main.URLS['basisprofielen']}/{KVK}/vestigingen", {"geoData": "false"})]
+    assert entry[4] == VESTIGINGSNUMMERS
+
+
+def test_vestigingen_error_is_not_kept(run_with_upstream):
+    def handler(request):
+        if request.url.path.endswith("/vestigingen"):
+            return httpx.Response(429, json={"fout": "rate limited"})
+        return kvk_handler(request)
+
+    response = run_with_upstream(handler, company_full)
+
+    assert response["details"]["vestigingen"]["_status"] == 429
+    assert response["vestigingsnummers"] == []
+    assert all(entry[1] != 429 for entry in main._cache.values())
@@ -0,0 +1,22 @@
+import httpx
+
+import main
+
+
+def test_debug_kvk_reports_upstream_http_versions(run_with_upstream):
+    def handler(request):
+        return httpx.Response(200, json={}, extensions={"http_version": b"HTTP/2"})
+
+    run_with_upstream(handler, lambda: main.kvk_get("https://api.kvk.nl/api/v1/basisprofielen/12345678"))
+
+    assert main.debug_kvk()["upstream_http_versions"] == {"HTTP/2": 1}
+
+
+def test_debug_kvk_does_not_expose_the_key(monkeypatch):
+    monkeypatch.setattr(main, "API_KEY", "secret-key")
+
+    info = main.debug_kvk()
+
+    assert info["KVK_API_KEY_len"] == len("secret-key")
+    assert "KVK_API_KEY_present" not in info
+    assert "secret-key" not in repr(info)
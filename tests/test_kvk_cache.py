@@ -0,0 +1,138 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import main
+
+URL = "https://api.kvk.nl/api/v1/basisprofielen/12345678"
+
+
+def test_success_is_cached(run_with_upstream):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"kvkNummer": "12345678"})
+
+    async def go():
+        first = await main.kvk_get(URL)
+        second = await main.kvk_get(URL)
+        return first, second
+
+    first, second = run_with_upstream(handler, go)
+
+    assert first == {"kvkNummer": "12345678"}
+    assert second is first
+    assert len(calls) == 1
+    assert main._cache_stats["hits"] == 1
+
+
+def test_server_error_is_not_cached(run_with_upstream):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503, json={"fout": "busy"})
+
+    async def go():
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                await main.kvk_get(URL)
+            assert exc.value.status_code == 503
+
+    run_with_upstream(handler, go)
+
+    assert len(calls) == 2
+    assert main._cache == {}
+
+
+def test_not_found_uses_short_ttl(run_with_upstream):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(404, json={"fout": "not found"})
+
+    async def go():
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                await main.kvk_get(URL)
+            assert exc.value.status_code == 404
+
+    run_with_upstream(handler, go)
+
+    assert len(calls) == 1
+    entry = main._cache[main._cache_key(URL)]
+    assert entry[1] == 404
+    assert entry[0] - time.monotonic() <= main.CACHE_TTL_NOT_FOUND
+
+
+def test_concurrent_calls_share_one_upstream_request(run_with_upstream):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"kvkNummer": "12345678"})
+
+    async def go():
+        return await asyncio.gather(main.kvk_get(URL), main.kvk_get(URL))
+
+    first, second = run_with_upstream(handler, go)
+
+    assert first == second == {"kvkNummer": "12345678"}
+    assert len(calls) == 1
+
+    stats = main.debug_cache()
+    assert (stats["misses"], stats["coalesced"]) == (1, 1)
+    assert stats["hit_ratio"] == 0.0
+    assert stats["avoided_ratio"] == 0.5
+
+
+def test_cancelled_first_caller_does_not_cancel_followers(run_with_upstream):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"kvkNummer": "12345678"})
+
+    async def go():
+        leader = asyncio.ensure_future(main.kvk_get(URL))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(main.kvk_get(URL))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert run_with_upstream(handler, go) == {"kvkNummer": "12345678"}
+    assert len(calls) == 1
+
+
+def test_expired_entry_is_revalidated_with_etag(run_with_upstream):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(200, json={"kvkNummer": "12345678"}, headers={"ETag": '"v1"'})
+
+    async def go():
+        first = await main.kvk_get(URL)
+        key = main._cache_key(URL)
+        main._cache[key] = (0.0, *main._cache[key][1:])
+        second = await main.kvk_get(URL)
+        return first, second
+
+    first, second = run_with_upstream(handler, go)
+
+    assert second is first
+    assert len(calls) == 2
+    assert "If-None-Match" not in calls[0].headers
+    assert calls[1].headers["If-None-Match"] == '"v1"'
+    assert main._cache_stats["revalidated"] == 1
+    assert main._cache[main._cache_key(URL)][0] > time.monotonic()
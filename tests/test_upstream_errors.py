@@ -0,0 +1,30 @@
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import main
+
+URL = "https://api.kvk.nl/api/v1/vestigingsprofielen/000000000100"
+
+
+@pytest.mark.parametrize(
+    "exc, status_code",
+    [
+        (httpx.PoolTimeout("pool exhausted"), 503),
+        (httpx.ReadTimeout("read timed out"), 504),
+        (httpx.ConnectError("connection refused"), 502),
+    ],
+)
+def test_transport_errors_map_to_http_status(run_with_upstream, exc, status_code):
+    def handler(request):
+        raise exc
+
+    async def go():
+        with pytest.raises(HTTPException) as caught:
+            await main.kvk_get(URL)
+        return caught.value
+
+    error = run_with_upstream(handler, go)
+
+    assert error.status_code == status_code
+    assert main._cache == {}
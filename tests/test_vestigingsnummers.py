@@ -0,0 +1,24 @@
+import main
+
+
+def test_keeps_kvk_order_and_drops_duplicates():
+    payload = {
+        "vestigingen": [
+            {"vestigingsnummer": "000000000300"},
+            {"vestigingsnummer": "000000000100"},
+            {"vestigingsNummer": 200},
+            "not-a-dict",
+            {"naam": "no number"},
+        ],
+        "_embedded": {
+            "items": [{"vestigingsnummer": "000000000100"}, {"vestigingsnummer": "000000000050"}],
+            "links": {"self": "ignored"},
+        },
+    }
+
+    assert main.extract_vestigingsnummers(payload) == ["000000000300", "000000000100", "200", "000000000050"]
+
+
+def test_handles_empty_and_error_payloads():
+    assert main.extract_vestigingsnummers({}) == []
+    assert main.extract_vestigingsnummers({"_error": "boom", "_status": 500, "_url": "x"}) == []